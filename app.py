@@ -4,60 +4,102 @@ RAAM 2025 Live Dashboard - Version 35 (Final & Complete)
 - Alle bisherigen Features sind vollständig enthalten und funktionsfähig.
 """
 
+# folium, pydeck und plotly werden erst dort importiert, wo Karte bzw. Diagramme gebaut werden
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import folium
-from streamlit_folium import st_folium
+import numpy as np
+from streamlit_autorefresh import st_autorefresh
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 import json
+import html
+import io
+import os
+import tempfile
+import time
+from bisect import bisect_left
+from operator import itemgetter
 from timezonefinder import TimezoneFinder
 from pytz import timezone
 import gpxpy
 from geopy.distance import great_circle
 
+# --- KONSTANTEN ---
+
+ROUTE_FILE = 'raam_route.gpx'
+SNAPSHOT_FILE = os.path.join(tempfile.gettempdir(), 'raam_snapshot.json')
+SNAPSHOT_MAX_AGE = 600  # Sekunden, so lange darf der Snapshot bei einem Ausfall noch angezeigt werden
+ELEVATION_PLOT_POINTS = 2000
+CARDINAL_DIRECTIONS = ("N", "NNO", "NO", "ONO", "O", "OSO", "SO", "SSO", "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW")
+DAYS_DE = ("Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag")
+WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
+WEATHER_PARAMS = {"current": "temperature_2m,relative_humidity_2m,precipitation,wind_speed_10m,wind_direction_10m", "hourly": "temperature_2m,relative_humidity_2m,precipitation", "temperature_unit": "celsius", "precipitation_unit": "mm", "wind_speed_unit": "kmh"}
+
+# Muster für die Marker-Blöcke in TrackLeaders' mainpoints.js, einmalig kompiliert
+STATUS_RE = re.compile(r"\.mystatus\s*=\s*'(.*?)';")
+CATEGORY_RE = re.compile(r"\.mycategory\s*=\s*'(.*?)';")
+MARKER_RE = re.compile(r"L\.marker\(\[([\d.-]+),\s*([\d.-]+)\]")
+TOOLTIP_RE = re.compile(r"bindTooltip\(\"<b>\(([\w\d]+)\)\s*(.*?)<\/b>.*?<br>([\d.]+)\s*mph at route mile ([\d.]+)")
+
+# Namensmuster zur Erkennung von Fritz Geers (Groß-/Kleinschreibung egal)
+FRITZ_RE = re.compile(r'fritz|geers|gers', re.IGNORECASE)
+
 # --- FUNKTIONEN ---
 
+@st.cache_resource
+def get_http_session():
+    """Gemeinsame HTTP-Session, damit TCP/TLS-Verbindungen über Reruns hinweg wiederverwendet werden."""
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'})
+    # Kurze Aussetzer der Gateways (502-504) und Verbindungsfehler wiederholen, aber keine Read-Timeouts:
+    # ein hängender Server soll den Lauf nicht mehrfach blockieren
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=Retry(total=2, read=0, backoff_factor=0.3, status_forcelist=[502, 503, 504]))
+    session.mount('https://', adapter); session.mount('http://', adapter)
+    return session
+
 def degrees_to_cardinal(d):
     """Konvertiert Grad in eine Himmelsrichtung."""
     if d is None: return ""
-    dirs = ["N", "NNO", "NO", "ONO", "O", "OSO", "SO", "SSO", "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW"]
     ix = int((d + 11.25)/22.5)
-    return dirs[ix % 16]
+    return CARDINAL_DIRECTIONS[ix % 16]
 
-@st.cache_data(ttl=3600)
-def load_and_process_gpx(file_path='raam_route.gpx'):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as gpx_file:
-            gpx = gpxpy.parse(gpx_file)
-        route_points = [{'lat': p.latitude, 'lon': p.longitude, 'ele': p.elevation} for p in gpx.tracks[0].segments[0].points]
-        distance_map, cumulative_distance_miles = [], 0.0
-        if len(route_points) > 1:
-            for i in range(len(route_points)):
-                point_data = {'dist': cumulative_distance_miles, 'lat': route_points[i]['lat'], 'lon': route_points[i]['lon'], 'ele': route_points[i]['ele']}
-                if i > 0:
-                    p1, p2 = (route_points[i-1]['lat'], route_points[i-1]['lon']), (route_points[i]['lat'], route_points[i]['lon'])
-                    cumulative_distance_miles += great_circle(p1, p2).miles
-                    point_data['dist'] = cumulative_distance_miles
-                distance_map.append(point_data)
-        total_distance = distance_map[-1]['dist'] if distance_map else 0
-        return distance_map, total_distance
-    except FileNotFoundError:
-        st.error(f"GPX-Datei nicht gefunden! Stelle sicher, dass '{file_path}' im Hauptverzeichnis deiner App liegt.")
-        return None, 0
-    except Exception as e:
-        st.error(f"Fehler beim Verarbeiten der GPX-Datei: {e}")
-        return None, 0
+@st.cache_resource
+def load_and_process_gpx(file_path=ROUTE_FILE):
+    """Liest die Strecke einmal pro Prozess; Fehler werden nicht gecacht, sondern an den Aufrufer weitergereicht."""
+    with open(file_path, 'r', encoding='utf-8') as gpx_file:
+        gpx = gpxpy.parse(gpx_file)
+    route_points = [{'lat': p.latitude, 'lon': p.longitude, 'ele': p.elevation} for p in gpx.tracks[0].segments[0].points]
+    distance_map, cumulative_distance_miles, cumulative_gain = [], 0.0, 0.0
+    if len(route_points) > 1:
+        for i in range(len(route_points)):
+            point_data = {'dist': cumulative_distance_miles, 'lat': route_points[i]['lat'], 'lon': route_points[i]['lon'], 'ele': route_points[i]['ele']}
+            if i > 0:
+                p1, p2 = (route_points[i-1]['lat'], route_points[i-1]['lon']), (route_points[i]['lat'], route_points[i]['lon'])
+                cumulative_distance_miles += great_circle(p1, p2).miles
+                point_data['dist'] = cumulative_distance_miles
+                ele1, ele2 = route_points[i-1]['ele'], route_points[i]['ele']
+                if ele1 is not None and ele2 is not None and ele2 > ele1: cumulative_gain += ele2 - ele1
+            # Kumulierte Höhenmeter bis zu diesem Punkt, damit Abfragen per Binärsuche statt Vollscan gehen
+            point_data['gain'] = cumulative_gain
+            distance_map.append(point_data)
+    total_distance = distance_map[-1]['dist'] if distance_map else 0
+    # Distanz und kumulierter Anstieg zusätzlich als numpy-Arrays für spaltenweise Abfragen
+    route_arrays = (np.array([p['dist'] for p in distance_map]), np.array([p['gain'] for p in distance_map])) if distance_map else None
+    return distance_map, total_distance, route_arrays
+
+def get_route_segment(target_distance_miles, distance_map):
+    """Liefert die Routenpunkte vor und ab der Zieldistanz per Binärsuche über die kumulierte Distanz."""
+    ix = bisect_left(distance_map, target_distance_miles, key=itemgetter('dist'))
+    if ix == len(distance_map): return distance_map[-1], distance_map[-1]
+    return distance_map[max(ix - 1, 0)], distance_map[ix]
 
 def get_coords_for_distance(target_distance_miles, distance_map):
     if not distance_map: return None
-    p1 = distance_map[0]
-    for point in distance_map:
-        if point['dist'] >= target_distance_miles: p2 = point; break
-        p1 = point
-    else: p2 = p1
+    p1, p2 = get_route_segment(target_distance_miles, distance_map)
     dist_p1, dist_p2 = p1['dist'], p2['dist']
     if (dist_p2 - dist_p1) == 0: return {'lat': p1['lat'], 'lon': p1['lon']}
     ratio = (target_distance_miles - dist_p1) / (dist_p2 - dist_p1)
@@ -66,11 +108,7 @@ def get_coords_for_distance(target_distance_miles, distance_map):
 
 def get_current_gradient(current_distance_miles, distance_map):
     if not distance_map: return "N/A"
-    p1 = distance_map[0]
-    for point in distance_map:
-        if point['dist'] >= current_distance_miles: p2 = point; break
-        p1 = point
-    else: p2 = p1
+    p1, p2 = get_route_segment(current_distance_miles, distance_map)
     if p1['ele'] is None or p2['ele'] is None: return "N/A"
     elevation_change = p2['ele'] - p1['ele']
     distance_change = (p2['dist'] - p1['dist']) * 1609.34
@@ -78,91 +116,162 @@ def get_current_gradient(current_distance_miles, distance_map):
     gradient = (elevation_change / distance_change) * 100
     return f"{gradient:+.1f}%"
 
-def calculate_elevation_stats(current_distance_miles, distance_map):
-    if not distance_map: return {'climbed': 0, 'total': 0}
-    total_gain = 0; climbed_gain = 0
-    for i in range(1, len(distance_map)):
-        ele1 = distance_map[i-1]['ele']; ele2 = distance_map[i]['ele']
-        if ele1 is None or ele2 is None: continue
-        elevation_diff = ele2 - ele1
-        if elevation_diff > 0:
-            total_gain += elevation_diff
-            if distance_map[i]['dist'] <= current_distance_miles:
-                climbed_gain += elevation_diff
-    return {'climbed': int(climbed_gain), 'total': int(total_gain)}
-
 @st.cache_data(ttl=600)
-def get_weather_forecast(lat, lon):
-    if lat is None or lon is None: return None
+def get_weather_forecasts(points):
+    """Holt das Wetter für mehrere (lat, lon)-Positionen mit einer einzigen Open-Meteo-Anfrage."""
+    results = [None] * len(points)
+    valid = [(i, lat, lon) for i, (lat, lon) in enumerate(points) if lat is not None and lon is not None]
+    if not valid: return results
     try:
-        params = {"latitude": lat, "longitude": lon, "current": "temperature_2m,relative_humidity_2m,precipitation,wind_speed_10m,wind_direction_10m", "hourly": "temperature_2m,relative_humidity_2m,precipitation", "temperature_unit": "celsius", "precipitation_unit": "mm", "wind_speed_unit": "kmh"}
-        response = requests.get("https://api.open-meteo.com/v1/forecast", params=params, timeout=10)
+        params = {**WEATHER_PARAMS, "latitude": ",".join(str(lat) for _, lat, _ in valid), "longitude": ",".join(str(lon) for _, _, lon in valid)}
+        response = get_http_session().get(WEATHER_URL, params=params, timeout=(5, 10))
         response.raise_for_status()
-        return response.json()
-    except: return None
+        data = response.json()
+        # Bei nur einer Position liefert Open-Meteo ein Objekt statt einer Liste
+        if isinstance(data, dict): data = [data]
+        for (i, _, _), forecast in zip(valid, data): results[i] = forecast
+        return results
+    except: return [None] * len(points)
+
+@st.cache_resource
+def get_timezone_finder():
+    """Eine TimezoneFinder-Instanz für alle Reruns, da das Laden der Zeitzonendaten teuer ist."""
+    return TimezoneFinder()
 
 @st.cache_data(ttl=3600)
-def get_local_time(lat, lon):
-    if lat is None or lon is None: return "N/A"
-    try:
-        tf = TimezoneFinder(); tz_name = tf.timezone_at(lng=lon, lat=lat)
-        return datetime.now(timezone(tz_name)).strftime('%H:%M %Z') if tz_name else "N/A"
+def get_timezone_name(lat, lon):
+    if lat is None or lon is None: return None
+    try: return get_timezone_finder().timezone_at(lng=lon, lat=lat)
+    except: return None
+
+def get_local_time(lat, lon, now):
+    """Nur die Zeitzonen-Suche wird gecacht, die Uhrzeit selbst kommt aus dem aktuellen Lauf."""
+    tz_name = get_timezone_name(lat, lon)
+    try: return now.astimezone(timezone(tz_name)).strftime('%H:%M %Z') if tz_name else "N/A"
     except: return "N/A"
 
 # WIEDERHERGESTELLTE DISCORD-FUNKTION
 def send_to_discord_as_file(webhook_url, df, weather_data):
     if df.empty: return {"status": "error", "message": "DataFrame ist leer."}
     berlin_tz = timezone('Europe/Berlin'); now_berlin = datetime.now(berlin_tz)
-    days_de = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]; day_name = days_de[now_berlin.weekday()]
+    day_name = DAYS_DE[now_berlin.weekday()]
     timestamp_str = now_berlin.strftime(f"{day_name}, %d.%m.%Y um %H:%M Uhr")
     weather_summary = "Wetterdaten für Fritz nicht verfügbar."
     if weather_data and 'current' in weather_data and all(v is not None for v in weather_data['current'].values()):
         current = weather_data['current']; wind_dir = degrees_to_cardinal(current.get('wind_direction_10m'))
         weather_summary = (f"Aktuelles Wetter an Fritz' Position: {current.get('temperature_2m')}°C, {current.get('wind_speed_10m')} km/h Wind aus {wind_dir}, {current.get('relative_humidity_2m')}% Luftfeuchtigkeit, {current.get('precipitation')}mm Niederschlag.")
     content = (f"**RAAM Live-Export vom {timestamp_str} (Berliner Zeit)**\n\n🌦️ {weather_summary}\n\nDie vollständige Rangliste mit allen Statistiken befindet sich im Anhang.")
-    csv_data = df.to_csv(index=False, encoding='utf-8')
+    # CSV direkt als Bytes in einen Puffer schreiben, der ohne weitere Kopie hochgeladen wird
+    csv_buffer = io.BytesIO(); df.to_csv(csv_buffer, index=False, encoding='utf-8'); csv_buffer.seek(0)
     file_name = f"raam_live_export_{now_berlin.strftime('%Y%m%d_%H%M')}.csv"
     payload_json = {"content": content, "username": "RAAM Live Tracker", "avatar_url": "https://i.imgur.com/4M34hi2.png"}
-    files = {'file': (file_name, csv_data, 'text/csv')}
+    files = {'file': (file_name, csv_buffer, 'text/csv')}
     try:
         response = requests.post(webhook_url, data={'payload_json': json.dumps(payload_json)}, files=files, timeout=15)
         return {"status": "success", "message": f"Datei '{file_name}' gesendet!"} if 200 <= response.status_code < 300 else {"status": "error", "message": f"Discord-Fehler: {response.status_code}"}
     except requests.exceptions.RequestException as e: return {"status": "error", "message": f"Netzwerkfehler: {e}"}
 
-@st.cache_data(ttl=45)
+@st.cache_resource
+def get_export_executor():
+    """Hintergrund-Thread für den Discord-Upload, damit das Dashboard währenddessen bedienbar bleibt."""
+    return ThreadPoolExecutor(max_workers=1)
+
+@st.fragment(run_every=1)
+def show_discord_export_status():
+    future = st.session_state['discord_export']
+    if not future.done():
+        st.info("Sende an Discord..."); return
+    # Ergebnis für den nächsten Lauf ablegen und das Polling durch einen vollständigen Rerun beenden
+    st.session_state['discord_export_result'] = st.session_state.pop('discord_export').result()
+    st.rerun()
+
+def show_cache_stats():
+    """Zeigt den Speicherverbrauch der st.cache_data-Caches je Funktion in der Sidebar."""
+    # Streamlit bietet dafür keine öffentliche API; Trefferzahlen werden gar nicht erfasst
+    try:
+        from streamlit.runtime.caching.cache_data_api import get_data_cache_stats_provider
+        stats = [s for family in get_data_cache_stats_provider().get_stats().values() for s in family]
+    except Exception:
+        st.sidebar.caption("Cache-Statistiken in dieser Streamlit-Version nicht verfügbar"); return
+    if not stats: st.sidebar.caption("Caches sind leer"); return
+    for s in stats: st.sidebar.text(f"{s.cache_name}: {s.byte_length / 1024:.1f} KB")
+
+@st.cache_resource
+def get_feed_state():
+    """Merkt sich ETag/Last-Modified und die zuletzt geparsten Daten des TrackLeaders-Feeds."""
+    return {}
+
+@st.cache_data(ttl=45, show_spinner=False)
 def fetch_trackleaders_data():
     data_url = "https://trackleaders.com/spot/raam25/mainpoints.js"
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)', 'Referer': 'https://trackleaders.com/raam25f.php'}
+    headers = {'Referer': 'https://trackleaders.com/raam25f.php'}
+    feed_state = get_feed_state()
+    # Kaltstart: einen frischen Snapshot sofort zeigen, der Live-Abruf folgt nach Ablauf der TTL
+    if not feed_state:
+        snapshot = load_snapshot()
+        if snapshot:
+            saved_at, racers = snapshot; feed_state['racers'] = racers
+            st.info(f"Zeige gespeicherten Stand von {saved_at.strftime('%H:%M:%S')}, Live-Daten folgen in Kürze"); return racers
+    # Bedingte Anfrage: bei unverändertem Feed antwortet der Server mit 304 und das Parsen entfällt
+    if 'racers' in feed_state:
+        if feed_state.get('etag'): headers['If-None-Match'] = feed_state['etag']
+        if feed_state.get('last_modified'): headers['If-Modified-Since'] = feed_state['last_modified']
     try:
-        response = requests.get(data_url, headers=headers, timeout=20)
+        response = get_http_session().get(data_url, headers=headers, timeout=(3.05, 10))
+        if response.status_code == 304 and 'racers' in feed_state:
+            # Daten unverändert: nur das Alter des Snapshots zurücksetzen statt ihn neu zu schreiben
+            try: os.utime(SNAPSHOT_FILE)
+            except OSError: pass
+            return feed_state['racers']
         response.raise_for_status()
-        return parse_js_code_data(response.text)
+        racers = parse_js_code_data(response.text)
+        if racers:
+            feed_state.update(etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'), racers=racers)
+            save_snapshot(racers)
+        return racers
     except Exception as e:
+        # Bei einem Ausfall lieber den letzten Stand von der Platte zeigen als gar nichts
+        snapshot = load_snapshot()
+        if snapshot:
+            saved_at, racers = snapshot
+            st.warning(f"TrackLeaders nicht erreichbar ({e}) - zeige gespeicherten Stand von {saved_at.strftime('%H:%M:%S')}"); return racers
         st.error(f"Fehler im Datenabruf: {e}"); return None
 
+def save_snapshot(racers):
+    """Schreibt die zuletzt geparsten Fahrer atomar als JSON in das Temp-Verzeichnis."""
+    try:
+        tmp_file = f"{SNAPSHOT_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f: json.dump(racers, f)
+        os.replace(tmp_file, SNAPSHOT_FILE)
+    except OSError: pass
+
+def load_snapshot():
+    """Liefert (Zeitpunkt, Fahrer) des gespeicherten Snapshots oder None, wenn er fehlt oder zu alt ist."""
+    try:
+        mtime = os.stat(SNAPSHOT_FILE).st_mtime
+        if time.time() - mtime > SNAPSHOT_MAX_AGE: return None
+        with open(SNAPSHOT_FILE, 'r', encoding='utf-8') as f: return datetime.fromtimestamp(mtime), json.load(f)
+    except (OSError, ValueError): return None
+
 def parse_js_code_data(js_content):
     racers = []
     for block in js_content.split('markers.push('):
+        # Fehlende Felder über None-Prüfungen überspringen statt per Exception
+        status, category = STATUS_RE.search(block), CATEGORY_RE.search(block)
+        if not status or not category: continue
+        if status.group(1).lower() != 'active' or category.group(1).lower() != 'solo': continue
+        lat_lon, tooltip = MARKER_RE.search(block), TOOLTIP_RE.search(block)
+        if not lat_lon or not tooltip: continue
         try:
-            status = re.search(r"\.mystatus\s*=\s*'(.*?)';", block).group(1)
-            category = re.search(r"\.mycategory\s*=\s*'(.*?)';", block).group(1)
-            if status.lower() != 'active' or category.lower() != 'solo': continue
-            lat_lon = re.search(r"L\.marker\(\[([\d.-]+),\s*([\d.-]+)\]", block)
-            tooltip = re.search(r"bindTooltip\(\"<b>\(([\w\d]+)\)\s*(.*?)<\/b>.*?<br>([\d.]+)\s*mph at route mile ([\d.]+)", block)
-            if not all([lat_lon, tooltip]): continue
-            racers.append({'lat': float(lat_lon.group(1)), 'lon': float(lat_lon.group(2)), 'bib': tooltip.group(1),'name': tooltip.group(2).strip(), 'speed': float(tooltip.group(3)), 'distance_covered_miles': float(tooltip.group(4)),'category': category, 'position': 999})
-        except: continue
+            racers.append({'lat': float(lat_lon.group(1)), 'lon': float(lat_lon.group(2)), 'bib': tooltip.group(1),'name': tooltip.group(2).strip(), 'speed': float(tooltip.group(3)), 'distance_covered_miles': float(tooltip.group(4)),'category': category.group(1)})
+        except ValueError: continue
     if not racers: return None
-    df = pd.DataFrame(racers).sort_values(by='distance_covered_miles', ascending=False).reset_index(drop=True)
-    df['position'] = df.index + 1
-    return df.to_dict('records')
+    # Für die Platzierung reicht ein einfaches Sortieren der Liste, ein DataFrame wäre hier nur Overhead
+    racers.sort(key=itemgetter('distance_covered_miles'), reverse=True)
+    for position, racer in enumerate(racers, 1): racer['position'] = position
+    return racers
 
-def create_dataframe(racers_data):
-    df = pd.DataFrame(racers_data)
-    df['is_fritz'] = (df['bib'] == '675') | (df['name'].str.lower().str.contains('fritz|geers|gers', na=False, regex=True))
-    return df.sort_values('position')
-
-def calculate_all_stats(df, distance_map, total_route_dist):
+def calculate_all_stats(df, route_arrays, total_route_dist):
     if df.empty: return df
     if 'is_fritz' in df.columns and df['is_fritz'].any():
         fritz = df[df['is_fritz']].iloc[0]
@@ -170,68 +279,137 @@ def calculate_all_stats(df, distance_map, total_route_dist):
         def format_time_gap(h):
             if pd.isna(h) or h <= 0: return ""
             return f"~{int(h)}h {int((h*60)%60)}m" if h >= 1 else f"~{int(h*60)}m"
-        gaps = []
-        for _, row in df.iterrows():
-            if row['is_fritz']: gaps.append("Fritz Geers"); continue
-            gap_mi = row['distance_covered_miles'] - fritz_dist
-            if gap_mi > 0:
-                time_h = (gap_mi / fritz_speed) if fritz_speed > 0 else None
-                gaps.append(f"+{gap_mi:.1f} mi / {gap_mi*1.60934:.1f} km ({format_time_gap(time_h)})")
-            else:
-                time_h = (abs(gap_mi) / row['speed']) if row['speed'] > 0 else None
-                gaps.append(f"{gap_mi:.1f} mi / {gap_mi*1.60934:.1f} km ({format_time_gap(time_h)})")
-        df['gap_to_fritz'] = gaps
-    if distance_map:
-        new_cols = {'distance_remaining_miles': [], 'elevation_climbed_m': [], 'elevation_remaining_m': []}
-        total_elevation_gain = calculate_elevation_stats(total_route_dist, distance_map)['total']
-        for _, row in df.iterrows():
-            new_cols['distance_remaining_miles'].append(total_route_dist - row['distance_covered_miles'])
-            climbed = calculate_elevation_stats(row['distance_covered_miles'], distance_map)['climbed']
-            new_cols['elevation_climbed_m'].append(climbed)
-            new_cols['elevation_remaining_m'].append(total_elevation_gain - climbed)
-        df = pd.concat([df, pd.DataFrame(new_cols)], axis=1)
+        # Abstand und Zeitabstand spaltenweise rechnen, nur die Texte entstehen noch je Fahrer
+        gap_mi = df['distance_covered_miles'].to_numpy() - fritz_dist
+        speed = df['speed'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            time_h = np.where(gap_mi > 0, gap_mi / fritz_speed if fritz_speed > 0 else np.nan, np.where(speed > 0, np.abs(gap_mi) / speed, np.nan))
+        gaps = [f"{'+' if g > 0 else ''}{g:.1f} mi / {g*1.60934:.1f} km ({format_time_gap(h)})" for g, h in zip(gap_mi.tolist(), time_h.tolist())]
+        df['gap_to_fritz'] = np.where(df['is_fritz'], "Fritz Geers", gaps)
+    if route_arrays:
+        route_dist, route_gain = route_arrays
+        total_elevation_gain = int(route_gain[-1])
+        # Anstieg aller Fahrer in einem Schritt per searchsorted statt bisect je Fahrer
+        ix = np.searchsorted(route_dist, df['distance_covered_miles'].to_numpy(), side='right')
+        climbed = np.where(ix > 0, route_gain[ix - 1], 0).astype(int)
+        df['distance_remaining_miles'] = (total_route_dist - df['distance_covered_miles']).round(2)
+        df['elevation_climbed_m'] = climbed
+        df['elevation_remaining_m'] = total_elevation_gain - climbed
         df['distance_covered_miles'] = df['distance_covered_miles'].round(2)
-        df['distance_remaining_miles'] = df['distance_remaining_miles'].round(2)
     return df
 
-def create_elevation_plot(current_distance, racer_name, distance_map):
+@st.cache_data(ttl=60, show_spinner=False)
+def build_standings(racers_data, has_route):
+    """Erstellt die Rangliste inkl. Statistiken einmal pro Datenstand statt bei jedem Rerun."""
+    # has_route gehört zum Cache-Schlüssel, damit nach einem GPX-Fehler nicht die Rangliste ohne Strecke hängen bleibt
+    _, total_route_dist, route_arrays = load_and_process_gpx() if has_route else (None, 0, None)
+    # parse_js_code_data liefert die Fahrer bereits nach Position sortiert
+    df = pd.DataFrame(racers_data).astype({'category': 'category', 'position': 'int32'})
+    df['is_fritz'] = (df['bib'] == '675') | df['name'].str.contains(FRITZ_RE, na=False)
+    return calculate_all_stats(df, route_arrays, total_route_dist)
+
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def build_racer_map(racers):
+    """Baut und rendert die Folium-Karte nur neu, wenn sich die Positionsdaten geändert haben."""
+    import folium
+    from folium.plugins import MarkerCluster
+    lats, lons = [r[0] for r in racers], [r[1] for r in racers]
+    m = folium.Map(location=[sum(lats) / len(lats), sum(lons) / len(lons)], zoom_start=6)
+    # Fritz bleibt außerhalb des Clusters, damit sein Stern immer sichtbar ist
+    cluster = MarkerCluster().add_to(m)
+    for lat, lon, popup, tooltip, is_fritz in racers:
+        if is_fritz: folium.Marker([lat, lon], popup=popup, tooltip=tooltip, icon=folium.Icon(color='gold', icon='star', prefix='fa')).add_to(m)
+        # Schlanke SVG-Kreise statt Icon-Marker für alle anderen Fahrer
+        else: folium.CircleMarker([lat, lon], radius=6, color='blue', fill=True, fill_opacity=0.8, popup=popup, tooltip=tooltip).add_to(cluster)
+    # Fertiges HTML zwischenspeichern, damit das Template-Rendering nicht bei jedem Rerun erneut läuft
+    return m.get_root().render()
+
+def escape_map_text(text):
+    """Entschärft Feed-Text für die Folium-Karte, die ihn als HTML in JS-Template-Literale einsetzt."""
+    return html.escape(text).replace('`', '&#96;').replace('$', '&#36;')
+
+def create_position_deck(map_df):
+    """WebGL-Übersichtskarte (pydeck) mit einem Punkt pro Fahrer, Fritz in Gold und zuoberst."""
+    import pydeck as pdk
+    deck_df = map_df[['lat', 'lon', 'is_fritz', 'tooltip']].sort_values('is_fritz')
+    deck_df['color'] = [[255, 215, 0] if is_fritz else [0, 100, 255] for is_fritz in deck_df['is_fritz']]
+    layer = pdk.Layer('ScatterplotLayer', data=deck_df, get_position='[lon, lat]', get_fill_color='color', get_radius=15000, radius_min_pixels=4, pickable=True)
+    view = pdk.ViewState(latitude=deck_df['lat'].mean(), longitude=deck_df['lon'].mean(), zoom=4)
+    return pdk.Deck(layers=[layer], initial_view_state=view, tooltip={'text': '{tooltip}'})
+
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def create_elevation_plot(current_distance, racer_name):
+    """Höhenprofil mit Fahrerposition, neu gebaut nur wenn sich die Position ändert."""
+    distance_map, _, _ = load_and_process_gpx()
     if not distance_map: return None
+    import plotly.express as px
     plot_df = pd.DataFrame(distance_map)
-    fig = px.area(plot_df, x="dist", y="ele", title="Höhenprofil der Gesamtstrecke")
+    # Für die Darstellung reichen wenige tausend Punkte, das hält das an den Browser gesendete JSON klein
+    step = max(len(plot_df) // ELEVATION_PLOT_POINTS, 1)
+    fig = px.area(plot_df.iloc[list(range(0, len(plot_df) - 1, step)) + [len(plot_df) - 1]], x="dist", y="ele", title="Höhenprofil der Gesamtstrecke")
     current_elevation = plot_df.iloc[(plot_df['dist'] - current_distance).abs().argsort()[:1]]['ele'].values[0]
     fig.add_vline(x=current_distance, line_width=2, line_dash="dash", line_color="red")
     fig.add_annotation(x=current_distance, y=current_elevation + 100, text=f"📍 {racer_name}", showarrow=True, arrowhead=1, font=dict(color="black"), bgcolor="rgba(255,255,255,0.7)")
     fig.update_layout(xaxis_title="Distanz (Meilen)", yaxis_title="Höhe (Meter)")
     return fig
 
+@st.cache_data(ttl=60, show_spinner=False)
+def create_top10_figure(rows):
+    """Balkendiagramm der Top 10 aus (name, distanz, is_fritz)-Tupeln, Fritz in Gold."""
+    import plotly.graph_objects as go
+    names, distances, is_fritz = zip(*rows)
+    fig = go.Figure(go.Bar(y=names, x=distances, orientation='h', text=distances, texttemplate='%{text:.1f} mi', textposition='outside', marker_color=['gold' if f else 'lightblue' for f in is_fritz]))
+    fig.update_layout(xaxis_title="Distanz (Meilen)", yaxis_title="Fahrer")
+    return fig
+
 # --- HAUPTANWENDUNG (main) ---
 def main():
     st.set_page_config(page_title="RAAM 2025 Live Tracker - Fritz Geers", page_icon="🚴", layout="wide")
     st.sidebar.title("🚴 RAAM 2025 Live Tracker")
-    if st.sidebar.button("🔄 Jetzt aktualisieren"): st.cache_data.clear(); st.rerun()
+    # Nur die Netzwerk-Caches verwerfen; Rangliste und Diagramme hängen an den Daten und erneuern sich dadurch selbst
+    if st.sidebar.button("🔄 Jetzt aktualisieren"): fetch_trackleaders_data.clear(); get_weather_forecasts.clear(); st.rerun()
     auto_refresh = st.sidebar.checkbox("Auto-Refresh (60 Sek)", value=True)
+    if auto_refresh: st_autorefresh(interval=60_000, key="raam_refresh")
     st.sidebar.markdown("---")
     st.sidebar.info("**Live-Daten** von TrackLeaders\n\n**Fritz Geers** (#675) wird mit ⭐ hervorgehoben")
+    # Cache-Diagnose nutzt interne Streamlit-APIs und erscheint nur, wenn ?debug= dem Secret DEBUG_TOKEN entspricht
+    try: debug_mode = bool(st.secrets.get("DEBUG_TOKEN")) and st.query_params.get("debug") == st.secrets["DEBUG_TOKEN"]
+    except Exception: debug_mode = False
+    if debug_mode: show_cache_stats()
     
     st.title("🏆 Race Across America 2025 - Live Tracking")
     
-    distance_map, total_route_dist = load_and_process_gpx()
+    try: distance_map, total_route_dist, _ = load_and_process_gpx()
+    except FileNotFoundError:
+        st.error(f"GPX-Datei nicht gefunden! Stelle sicher, dass '{ROUTE_FILE}' im Hauptverzeichnis deiner App liegt.")
+        distance_map, total_route_dist = None, 0
+    except Exception as e:
+        st.error(f"Fehler beim Verarbeiten der GPX-Datei: {e}")
+        distance_map, total_route_dist = None, 0
     racers_data = fetch_trackleaders_data()
     
     if not racers_data:
         st.warning("Momentan konnten keine verarbeitbaren Live-Daten gefunden werden."); return
 
-    df = create_dataframe(racers_data)
-    df = calculate_all_stats(df, distance_map, total_route_dist)
+    df = build_standings(racers_data, bool(distance_map))
     
     st.success(f"{len(df)} Solo-Fahrer geladen!")
-    st.markdown(f"*Aktualisiert: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}*")
+    now = datetime.now().astimezone()
+    st.markdown(f"*Aktualisiert: {now.strftime('%d.%m.%Y %H:%M:%S')}*")
     
     fritz_data = df[df['is_fritz']]
     weather_data_full = None
     if not fritz_data.empty:
         fritz = fritz_data.iloc[0]
-        weather_data_full = get_weather_forecast(fritz.get('lat'), fritz.get('lon'))
+        future_dist_1h = fritz['distance_covered_miles'] + fritz['speed']
+        future_dist_24h = fritz['distance_covered_miles'] + (fritz['speed'] * 24)
+        future_coords_1h = get_coords_for_distance(future_dist_1h, distance_map)
+        future_coords_24h = get_coords_for_distance(future_dist_24h, distance_map)
+        weather_data_full, weather_1h, weather_24h = get_weather_forecasts((
+            (fritz.get('lat'), fritz.get('lon')),
+            (future_coords_1h['lat'], future_coords_1h['lon']) if future_coords_1h else (None, None),
+            (future_coords_24h['lat'], future_coords_24h['lon']) if future_coords_24h else (None, None),
+        ))
         
         st.markdown("### ⭐ Fritz Geers Live Status")
         cols1 = st.columns(6)
@@ -239,7 +417,7 @@ def main():
         cols1[1].metric("Distanz", f"{fritz['distance_covered_miles']:.1f} mi")
         cols1[2].metric("Geschwindigkeit", f"{fritz['speed']:.1f} mph")
         cols1[3].metric("Startnummer", f"#{fritz['bib']}")
-        cols1[4].metric("Lokale Zeit", get_local_time(fritz.get('lat'), fritz.get('lon')))
+        cols1[4].metric("Lokale Zeit", get_local_time(fritz.get('lat'), fritz.get('lon'), now))
         if distance_map: cols1[5].metric("Steigung", get_current_gradient(fritz['distance_covered_miles'], distance_map))
         
         if distance_map:
@@ -258,35 +436,30 @@ def main():
                 st.write(f"{weather_data_full['current']['relative_humidity_2m']}% / {weather_data_full['current']['precipitation']} mm")
         with col_weather2:
             st.write("**In 1 Stunde**")
-            if distance_map:
-                future_dist_1h = fritz['distance_covered_miles'] + fritz['speed']
-                future_coords_1h = get_coords_for_distance(future_dist_1h, distance_map)
-                if future_coords_1h:
-                    st.write(f"📍 bei Meile {future_dist_1h:.1f}")
-                    weather_1h = get_weather_forecast(future_coords_1h.get('lat'), future_coords_1h.get('lon'))
-                    if weather_1h and 'hourly' in weather_1h and len(weather_1h.get('hourly', {}).get('temperature_2m', [])) > 1:
-                        st.metric("Temperatur", f"{weather_1h['hourly']['temperature_2m'][1]} °C", label_visibility="collapsed")
-                        st.write(f"{weather_1h['hourly']['relative_humidity_2m'][1]}% / {weather_1h['hourly']['precipitation'][1]} mm")
+            if future_coords_1h:
+                st.write(f"📍 bei Meile {future_dist_1h:.1f}")
+                if weather_1h and 'hourly' in weather_1h and len(weather_1h.get('hourly', {}).get('temperature_2m', [])) > 1:
+                    st.metric("Temperatur", f"{weather_1h['hourly']['temperature_2m'][1]} °C", label_visibility="collapsed")
+                    st.write(f"{weather_1h['hourly']['relative_humidity_2m'][1]}% / {weather_1h['hourly']['precipitation'][1]} mm")
         with col_weather3:
             st.write("**In 24 Stunden**")
-            if distance_map:
-                future_dist_24h = fritz['distance_covered_miles'] + (fritz['speed'] * 24)
-                future_coords_24h = get_coords_for_distance(future_dist_24h, distance_map)
-                if future_coords_24h:
-                    st.write(f"📍 bei Meile {future_dist_24h:.1f}")
-                    weather_24h = get_weather_forecast(future_coords_24h.get('lat'), future_coords_24h.get('lon'))
-                    if weather_24h and 'hourly' in weather_24h and len(weather_24h.get('hourly', {}).get('temperature_2m', [])) > 23:
-                        st.metric("Temperatur", f"{weather_24h['hourly']['temperature_2m'][23]} °C", label_visibility="collapsed")
-                        st.write(f"{weather_24h['hourly']['relative_humidity_2m'][23]}% / {weather_24h['hourly']['precipitation'][23]} mm")
+            if future_coords_24h:
+                st.write(f"📍 bei Meile {future_dist_24h:.1f}")
+                if weather_24h and 'hourly' in weather_24h and len(weather_24h.get('hourly', {}).get('temperature_2m', [])) > 23:
+                    st.metric("Temperatur", f"{weather_24h['hourly']['temperature_2m'][23]} °C", label_visibility="collapsed")
+                    st.write(f"{weather_24h['hourly']['relative_humidity_2m'][23]}% / {weather_24h['hourly']['precipitation'][23]} mm")
     
     try:
         webhook_url = st.secrets["DISCORD_WEBHOOK_URL"]
         st.sidebar.markdown("---"); st.sidebar.header("Export")
         if st.sidebar.button("Export an Discord senden"):
-            with st.spinner("Sende an Discord..."):
-                result = send_to_discord_as_file(webhook_url, df, weather_data_full)
-                if result.get("status") == "success": st.sidebar.success(result.get("message"))
-                else: st.sidebar.error(result.get("message"))
+            st.session_state['discord_export'] = get_export_executor().submit(send_to_discord_as_file, webhook_url, df, weather_data_full)
+        if 'discord_export' in st.session_state:
+            with st.sidebar: show_discord_export_status()
+        result = st.session_state.pop('discord_export_result', None)
+        if result:
+            if result.get("status") == "success": st.sidebar.success(result.get("message"))
+            else: st.sidebar.error(result.get("message"))
     except KeyError: pass
             
     st.markdown("---")
@@ -294,35 +467,40 @@ def main():
     
     with tab1:
         st.subheader("Live Rangliste - Solo Kategorie")
-        display_cols = ['position', 'bib', 'name', 'distance_covered_miles', 'speed', 'gap_to_fritz', 'is_fritz']
-        display_df = df.reindex(columns=display_cols, fill_value="")
-        display_df.rename(columns={'position': 'Pos', 'bib': 'Nr.', 'name': 'Name', 'distance_covered_miles': 'Distanz (mi)', 'speed': 'Geschw. (mph)', 'gap_to_fritz': 'Abstand zu Fritz'}, inplace=True)
-        def highlight_fritz(row): return ['background-color: #ffd700'] * len(row) if row.is_fritz else [''] * len(row)
-        st.dataframe(display_df.style.apply(highlight_fritz, axis=1), use_container_width=True, height=800, column_config={"is_fritz": None})
+        column_labels = {'star': '⭐', 'position': 'Pos', 'bib': 'Nr.', 'name': 'Name', 'distance_covered_miles': 'Distanz (mi)', 'speed': 'Geschw. (mph)', 'gap_to_fritz': 'Abstand zu Fritz'}
+        display_cols = [c for c in column_labels if c in df.columns]
+        # Überschriften per column_config statt umbenannter Kopie; Markierung über eine eigene Spalte statt pandas Styler
+        display_df = df[display_cols].assign(star=np.where(df['is_fritz'], '⭐', ''))
+        st.dataframe(display_df, width="stretch", height=800, column_order=['star', *display_cols], column_config=column_labels)
 
     with tab2:
         st.subheader("Live Positionen auf der Karte")
-        map_df = df[df['lat'] != 0]
+        # Popup- und Tooltip-Texte spaltenweise erzeugen statt per f-String je Fahrer
+        # Namen stammen aus dem TrackLeaders-Feed und werden für Popup und Tooltip der Folium-Karte entschärft;
+        # der pydeck-Tooltip zeigt reinen Text und bekommt den Namen unverändert
+        position_str = df['position'].astype(str)
+        safe_name = df['name'].map(escape_map_text)
+        map_df = df.loc[df['lat'] != 0, ['lat', 'lon', 'is_fritz']].assign(
+            popup='<b>' + safe_name + '</b><br>Pos: #' + position_str + '<br>Dist: ' + df['distance_covered_miles'].round(1).astype(str) + ' mi',
+            tooltip='#' + position_str + ' ' + df['name'],
+            html_tooltip='#' + position_str + ' ' + safe_name)
         if not map_df.empty:
-            m = folium.Map(location=[map_df['lat'].mean(), map_df['lon'].mean()], zoom_start=6)
-            for _, r in map_df.iterrows():
-                folium.Marker([r['lat'], r['lon']], popup=f"<b>{r['name']}</b><br>Pos: #{r['position']}<br>Dist: {r['distance_covered_miles']:.1f} mi", tooltip=f"#{r['position']} {r['name']}", icon=folium.Icon(color='gold' if r['is_fritz'] else 'blue', icon='star' if r['is_fritz'] else 'bicycle', prefix='fa')).add_to(m)
-            st_folium(m, height=600, width=None)
+            st.pydeck_chart(create_position_deck(map_df), height=600)
+            # Die schwerere Folium-Karte mit Popups nur auf Wunsch erzeugen
+            if st.toggle("Detailkarte mit Popups anzeigen"):
+                # Kartenzustand wird nicht ausgewertet, daher reicht ein statisches iframe ohne Rückkanal
+                st.iframe(build_racer_map(tuple(map_df[['lat', 'lon', 'popup', 'html_tooltip', 'is_fritz']].itertuples(index=False, name=None))), height=600)
         
         if distance_map and not fritz_data.empty:
             st.subheader("Höhenprofil der Strecke")
-            elevation_fig = create_elevation_plot(fritz_data.iloc[0]['distance_covered_miles'], fritz_data.iloc[0]['name'], distance_map)
-            if elevation_fig: st.plotly_chart(elevation_fig, use_container_width=True)
+            elevation_fig = create_elevation_plot(float(fritz_data.iloc[0]['distance_covered_miles']), fritz_data.iloc[0]['name'])
+            if elevation_fig: st.plotly_chart(elevation_fig, width="stretch")
 
     with tab3:
         st.subheader("Top 10 nach Distanz")
-        top10 = df.head(10).sort_values('distance_covered_miles', ascending=True)
-        fig = px.bar(top10, y='name', x='distance_covered_miles', orientation='h', text='distance_covered_miles', labels={'name': 'Fahrer', 'distance_covered_miles': 'Distanz (Meilen)'})
-        fig.update_traces(texttemplate='%{text:.1f} mi', textposition='outside')
-        st.plotly_chart(fig, use_container_width=True)
-
-    if auto_refresh:
-        st.markdown('<meta http-equiv="refresh" content="60">', unsafe_allow_html=True)
+        # Die Positionen sind nach Distanz vergeben, die ersten zehn Zeilen sind also die Top 10
+        top10 = df.head(10).iloc[::-1]
+        st.plotly_chart(create_top10_figure(tuple(top10[['name', 'distance_covered_miles', 'is_fritz']].itertuples(index=False, name=None))), width="stretch")
 
 if __name__ == "__main__":
     main()